@@ -1,7 +1,12 @@
 #!/usr/bin/env python3
 import argparse
+import signal
+import threading
 
 from kademlia import kadnode
+from kademlia import profiling
+from kademlia import workers
+from kademlia.profiling import profiler
 
 def run_cli(node):
     def get_prompt():
@@ -32,6 +37,67 @@ def run_cli(node):
         elif cmd == 'get':
             ret = node.get_value(int(split[1]))
             print(f'Value: {ret}')
+        elif cmd == 'profile':
+            run_profile_cmd(node, split[1].split() if len(split) > 1 else [])
+
+
+def run_profile_cmd(node, args):
+    # In worker mode, the command is also passed on to the other workers
+    worker_mode = isinstance(node, workers.WorkerNode)
+
+    usage = f'Usage: profile on [{"|".join(profiling.MODES)}] [sample rate] | off | dump [file]'
+    if not args:
+        state = 'on' if profiler.enabled else 'off'
+        print(f'Profiling is {state} ({profiler.mode}, sample rate {profiler.sample_rate})')
+        print(usage)
+    elif args[0] == 'on':
+        try:
+            profiler.enable(mode=args[1] if len(args) > 1 else None,
+                            sample_rate=float(args[2]) if len(args) > 2 else None)
+        except ValueError as e:
+            print(e)
+            return
+        if worker_mode:
+            node.publish_profile(workers.PROFILE_ON, profiler.mode, profiler.sample_rate)
+    elif args[0] == 'off':
+        profiler.disable()
+        if worker_mode:
+            node.publish_profile(workers.PROFILE_OFF)
+    elif args[0] == 'dump':
+        output = args[1] if len(args) > 1 else None
+        if worker_mode:
+            node.publish_profile(workers.PROFILE_DUMP, output)
+        try:
+            output = profiler.dump(output)
+        except OSError as e:
+            print(f'Failed to write profile: {e}')
+            return
+        print(f'Profile written to {output}')
+        if worker_mode:
+            print(f'Other workers write to {output}.worker<N>')
+    else:
+        print(usage)
+
+
+def setup_profiling_signals():
+    # SIGUSR1 toggles profiling (dumping the results when turned off),
+    # SIGUSR2 dumps the results collected so far.
+    # Signal handlers run on the main thread, which may be holding the
+    # profiler lock in a profiled call from the CLI, so the work is handed
+    # to a thread of its own.
+    def run_in_thread(func):
+        def run():
+            try:
+                func()
+            except OSError as e:
+                profiler.logger.error('Failed to write profile: %s', e)
+
+        def handler(_signum, _frame):
+            threading.Thread(target=run, daemon=True).start()
+        return handler
+
+    signal.signal(signal.SIGUSR1, run_in_thread(profiler.toggle))
+    signal.signal(signal.SIGUSR2, run_in_thread(profiler.dump))
 
 
 
@@ -39,10 +105,37 @@ def main():
     parser = argparse.ArgumentParser()
     parser.add_argument('--listen-ip')
     parser.add_argument('--join')
+    parser.add_argument('--profile', choices=profiling.MODES,
+                        help='Profile the hot paths from startup')
+    parser.add_argument('--profile-rate', type=float, default=1.0,
+                        help='Fraction of calls to run under cProfile')
+    parser.add_argument('--profile-output', default=profiling.DEFAULT_OUTPUT)
+    parser.add_argument('--workers', type=int, default=1,
+                        help='Number of processes serving the port with SO_REUSEPORT')
     args = parser.parse_args()
 
-    node = kadnode.KadNode(args.listen_ip)
-    node.start_receive()
+    try:
+        profiling.check_sample_rate(args.profile_rate)
+    except ValueError as e:
+        parser.error(str(e))
+    if args.workers < 1:
+        parser.error('--workers must be at least 1')
+    if args.workers > 1 and not workers.reuse_port_supported():
+        parser.error('--workers requires SO_REUSEPORT, which is not supported on this platform')
+
+    profiler.output = args.profile_output
+    profiler.sample_rate = args.profile_rate
+    if args.profile:
+        profiler.enable(mode=args.profile)
+    setup_profiling_signals()
+
+    group = None
+    if args.workers > 1:
+        group = workers.WorkerGroup(args.workers, args.listen_ip)
+        node = group.start()
+    else:
+        node = kadnode.KadNode(args.listen_ip)
+        node.start_receive()
 
     if args.join:
         node.join_network(args.join)
@@ -52,7 +145,12 @@ def main():
     except KeyboardInterrupt:
         print()
 
-    node.close()
+    if group:
+        group.close()
+    else:
+        node.close()
+    if profiler.enabled:
+        profiler.dump()
 
 if __name__ == '__main__':
     main()
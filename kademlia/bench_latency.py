@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+"""
+Simulated end-to-end lookup latency, with and without RTT-aware routing.
+
+Nodes are spread over a number of hosts. Messages between nodes on the same
+host are cheap, messages crossing hosts are not. RPCs are delivered in-process
+through handle_request and the latency of each one is added to a simulated
+clock instead of being slept.
+
+Run with: python3 -m kademlia.bench_latency
+"""
+import argparse
+import logging
+import random
+import statistics
+
+from kademlia import kadnode
+from kademlia import protocol
+
+SAME_HOST_RTT = 0.0002
+CROSS_HOST_RTT = 0.010
+
+
+class Network(object):
+    def __init__(self, num_hosts, seed):
+        self.num_hosts = num_hosts
+        self.nodes = {}
+        self.clock = 0.0
+        # The latency model has its own random state, so that the messages
+        # sent by a run don't change the workload drawn by it.
+        self.random = random.Random(seed)
+
+    def host_of(self, ip):
+        return int(ip.split('.')[2])
+
+    def rtt(self, ip1, ip2):
+        base = SAME_HOST_RTT if self.host_of(ip1) == self.host_of(ip2) else CROSS_HOST_RTT
+        return base * self.random.uniform(0.8, 1.2)
+
+
+class SimNode(kadnode.KadNode):
+    def __init__(self, network, listenip, node_id, measure_rtt):
+        self.network = network
+        self.measure_rtt = measure_rtt
+        super().__init__(listenip=listenip, node_id=node_id)
+
+    def setup_logger(self):
+        # One handler per simulated node would print every message N times
+        return logging.getLogger('kademlia')
+
+    def send(self, addr, port, msg):
+        # Deliver the request directly, the response takes the place of the socket
+        self.network.clock += self.network.rtt(self.listenip, addr)
+        return self.network.nodes[addr].handle_request(msg, self.listenip)
+
+    @staticmethod
+    def wait_for_response(sock, timeout=2):
+        return str(sock)
+
+    def send_find_node(self, nodeid, peer_ip, peer_port, find_value=False):
+        if find_value:
+            findmsg = protocol.RPCMessage.find_value_request(sender=self.node_id, key=nodeid)
+        else:
+            findmsg = protocol.RPCMessage.find_node_request(sender=self.node_id, nodeid=nodeid)
+
+        start = self.network.clock
+        resp = self.wait_for_response(self.send(peer_ip, peer_port, str(findmsg)))
+        rtt = self.network.clock - start
+
+        respmsg = protocol.RPCMessage.parse(resp)
+        if self.measure_rtt:
+            self.node_list.add_node(peer_ip, peer_port, respmsg.sender, rtt=rtt)
+        return respmsg.data
+
+
+def build_network(num_nodes, num_hosts, measure_rtt, seed):
+    network = Network(num_hosts, seed)
+    ids = random.Random(seed)
+    id_size = 160
+    for index in range(num_nodes):
+        ip = f'10.0.{index % num_hosts}.{index // num_hosts + 1}'
+        node = SimNode(network, ip, ids.getrandbits(id_size), measure_rtt)
+        network.nodes[ip] = node
+
+    # Every node joins through the first one and then looks itself up to
+    # populate its routing table, as a freshly started node would.
+    nodes = list(network.nodes.values())
+    seed_node = nodes[0]
+    for node in nodes[1:]:
+        rtt = network.rtt(node.listenip, seed_node.listenip)
+        if not measure_rtt:
+            rtt = None
+        node.node_list.add_node(seed_node.listenip, kadnode.PORT, seed_node.node_id, rtt=rtt)
+        seed_node.node_list.add_node(node.listenip, kadnode.PORT, node.node_id)
+        node.node_lookup(node.node_id)
+    for node in nodes:
+        node.node_lookup(node.node_id)
+    return network
+
+
+def run(num_nodes, num_hosts, num_values, measure_rtt, seed):
+    network = build_network(num_nodes, num_hosts, measure_rtt, seed)
+    nodes = list(network.nodes.values())
+    # Both runs replay the same requests from the same nodes
+    workload = random.Random(seed)
+
+    keys = []
+    for index in range(num_values):
+        (key, _stored) = workload.choice(nodes).store_value(f'value {index}')
+        keys.append(key)
+
+    lookup_times = []
+    get_times = []
+    for key in keys:
+        node = workload.choice(nodes)
+        start = network.clock
+        node.node_lookup(key)
+        lookup_times.append(network.clock - start)
+
+        node = workload.choice(nodes)
+        start = network.clock
+        node.get_value(key)
+        get_times.append(network.clock - start)
+    return lookup_times, get_times
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--nodes', type=int, default=200)
+    parser.add_argument('--hosts', type=int, default=8)
+    parser.add_argument('--values', type=int, default=50)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    logging.getLogger('kademlia').setLevel(logging.ERROR)
+
+    print(f'{args.nodes} nodes on {args.hosts} hosts, {args.values} keys')
+    print(f'{"":12} {"lookup mean":>12} {"lookup p90":>12} {"get mean":>12} {"get p90":>12}')
+    for label, measure_rtt in [('xor only', False), ('rtt-aware', True)]:
+        lookup_times, get_times = run(args.nodes, args.hosts, args.values, measure_rtt, args.seed)
+        row = []
+        for times in (lookup_times, get_times):
+            row.append(statistics.mean(times) * 1000)
+            row.append(sorted(times)[int(len(times) * 0.9)] * 1000)
+        print(f'{label:12} ' + ' '.join(f'{ms:10.1f}ms' for ms in row))
+
+
+if __name__ == '__main__':
+    main()
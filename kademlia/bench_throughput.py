@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+"""
+Inbound RPC throughput against the number of worker processes.
+
+For each worker count, a node is started with that many SO_REUSEPORT
+workers and loaded by a number of client processes. Each client keeps a
+request outstanding on each of its sockets, so requests are spread over the
+workers by the kernel. Two workloads are measured:
+ * ping: PING requests, always answered by the receiving worker.
+ * data: STORE and FIND_VALUE requests on random keys. With N workers,
+   (N - 1) / N of them are forwarded to the worker owning the key.
+
+The cost of the forwarding hop itself (pickling the request, passing it
+through a multiprocessing.Queue and unpickling it in another process) is
+measured separately.
+
+The clients need CPU too, so on a host with C cores, scaling can only be
+seen up to roughly C / 2 workers.
+
+Run with: python3 -m kademlia.bench_throughput
+"""
+import argparse
+import logging
+import multiprocessing
+import os
+import random
+import socket
+import time
+
+from kademlia import kadnode
+from kademlia import protocol
+from kademlia import workers
+
+PING = 'ping'
+DATA = 'data'
+SOCKETS_PER_CLIENT = 8
+FORWARD_SAMPLES = 20000
+
+
+def quiet_logging():
+    # Set up before any node is created, so that nodes don't add a DEBUG
+    # handler printing every message
+    logger = logging.getLogger('kademlia')
+    logger.addHandler(logging.NullHandler())
+    logger.setLevel(logging.ERROR)
+
+
+def serve(num_workers, listenip, ready, stop):
+    quiet_logging()
+    group = workers.WorkerGroup(num_workers, listenip)
+    group.start()
+    # Give every worker time to bind the port
+    time.sleep(0.5 + 0.1 * num_workers)
+    ready.set()
+    stop.wait()
+    group.close()
+
+
+def make_request(workload, rng):
+    if workload == PING:
+        return protocol.RPCMessage.ping_request(sender=1)
+    key = rng.getrandbits(160)
+    if rng.random() < 0.5:
+        return protocol.RPCMessage.store_request(1, key, 'value')
+    return protocol.RPCMessage.find_value_request(1, key)
+
+
+def client(listenip, workload, duration, results, seed):
+    rng = random.Random(seed)
+    socks = [socket.socket(socket.AF_INET, socket.SOCK_DGRAM) for _ in range(SOCKETS_PER_CLIENT)]
+    for sock in socks:
+        sock.settimeout(0.5)
+
+    done = 0
+    lost = 0
+    deadline = time.monotonic() + duration
+    while time.monotonic() < deadline:
+        for sock in socks:
+            sock.sendto(str(make_request(workload, rng)).encode(), (listenip, kadnode.PORT))
+        for sock in socks:
+            try:
+                sock.recvfrom(protocol.MAX_MSG_SIZE)
+                done += 1
+            except socket.timeout:
+                lost += 1
+    results.put((done, lost))
+
+
+def measure_throughput(num_workers, listenip, workload, num_clients, duration):
+    ready = multiprocessing.Event()
+    stop = multiprocessing.Event()
+    server = multiprocessing.Process(target=serve, args=(num_workers, listenip, ready, stop))
+    server.start()
+    ready.wait()
+
+    results = multiprocessing.Queue()
+    clients = [multiprocessing.Process(target=client,
+                                       args=(listenip, workload, duration, results, seed))
+               for seed in range(num_clients)]
+    start = time.monotonic()
+    for process in clients:
+        process.start()
+    counts = [results.get() for _ in clients]
+    elapsed = time.monotonic() - start
+    for process in clients:
+        process.join()
+
+    stop.set()
+    server.join()
+    done = sum(count[0] for count in counts)
+    lost = sum(count[1] for count in counts)
+    return done / elapsed, lost
+
+
+def _echo_forwarded(inbox, outbox):
+    while True:
+        item = inbox.get()
+        if item is None:
+            break
+        outbox.put(len(item[1].data))
+
+
+def measure_forward_cost():
+    """Seconds per request passed to another worker through its inbox"""
+    inbox = multiprocessing.Queue()
+    outbox = multiprocessing.Queue()
+    receiver = multiprocessing.Process(target=_echo_forwarded, args=(inbox, outbox))
+    receiver.start()
+
+    rpc = protocol.RPCMessage.store_request(1, 2**159, 'value')
+    start = time.perf_counter()
+    for _ in range(FORWARD_SAMPLES):
+        inbox.put((workers.REQUEST, rpc, ('127.0.0.1', 5000)))
+    for _ in range(FORWARD_SAMPLES):
+        outbox.get()
+    elapsed = time.perf_counter() - start
+
+    inbox.put(None)
+    receiver.join()
+    return elapsed / FORWARD_SAMPLES
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--listen-ip', default='127.0.0.1')
+    parser.add_argument('--workers', default='1,2,4',
+                        help='Comma separated worker counts to measure')
+    parser.add_argument('--clients', type=int, default=4,
+                        help='Number of load generating processes')
+    parser.add_argument('--duration', type=float, default=3.0)
+    args = parser.parse_args()
+
+    if not workers.reuse_port_supported():
+        parser.error('SO_REUSEPORT is not supported on this platform')
+    # Workers inherit the quiet logging set up in the server process
+    multiprocessing.set_start_method('fork')
+
+    print(f'{os.cpu_count()} CPUs, {args.clients} client processes, {args.duration}s per run')
+    forward_cost = measure_forward_cost()
+    print(f'Forwarding hop: {forward_cost * 1e6:.1f}us per request')
+    print()
+    print(f'{"workers":>8} {"ping req/s":>12} {"data req/s":>12} {"forwarded":>10} {"lost":>6}')
+    for num_workers in [int(n) for n in args.workers.split(',')]:
+        (ping_rate, ping_lost) = measure_throughput(num_workers, args.listen_ip, PING,
+                                                    args.clients, args.duration)
+        (data_rate, data_lost) = measure_throughput(num_workers, args.listen_ip, DATA,
+                                                    args.clients, args.duration)
+        forwarded = (num_workers - 1) / num_workers
+        print(f'{num_workers:8} {ping_rate:12.0f} {data_rate:12.0f} {forwarded:10.0%} '
+              f'{ping_lost + data_lost:6}')
+
+
+if __name__ == '__main__':
+    main()
@@ -9,6 +9,7 @@ import sys
 
 from kademlia import node_list
 from kademlia import protocol
+from kademlia.profiling import profiled
 
 PORT = 1337
 ALPHA = 3
@@ -17,6 +18,9 @@ def generate_node_id(size):
     return random.getrandbits(size)
 
 class KadNode(object):
+    # Allow several processes to bind the listening port (see workers.py)
+    reuse_port = False
+
     def __init__(self, listenip=None, node_id=None):
         self.id_size = 160
         self.listenip = listenip
@@ -25,6 +29,7 @@ class KadNode(object):
         self.node_list = node_list.NodeList(id_size=self.id_size, nodeid=self.node_id)
         self._stop_recv = False
         self._recv_thread = None
+        self._sock = None
         self.stored_data = {}
 
         self.logger.info(f'Initialized node {self.node_id}')
@@ -41,8 +46,10 @@ class KadNode(object):
             findmsg = protocol.RPCMessage.find_value_request(sender=self.node_id, key=nodeid)
         else:
             findmsg = protocol.RPCMessage.find_node_request(sender=self.node_id, nodeid=nodeid)
+        start = time.monotonic()
         sock = self.send(peer_ip, peer_port, str(findmsg))
         resp = self.wait_for_response(sock)
+        rtt = time.monotonic() - start
 
         if not resp:
             self.logger.warning('FIND_NODE timeout')
@@ -52,23 +59,27 @@ class KadNode(object):
         respmsg = protocol.RPCMessage.parse(resp)
         if respmsg.rpcid != findmsg.rpcid:
             self.logger.error('Invalid RPC ID in FIND_NODE response')
+        else:
+            # Only a matching response says anything about the peer's RTT
+            self.node_list.add_node(peer_ip, peer_port, respmsg.sender, rtt=rtt)
 
         self.logger.debug('FIND_NODE response from node %s: %s', respmsg.sender, respmsg.data)
 
         return respmsg.data
 
 
+    @profiled
     def node_lookup(self, nodeid, find_value=False):
 
         closest = self.node_list.get_n_closest(nodeid, ALPHA)
-        shortlist = node_list.NodeList.sort_by_distance(closest, nodeid)
+        shortlist = self.node_list.sort_by_proximity(closest, nodeid)
 
         if not shortlist:
             self.logger.warning('Failed to find node for FIND_NODE request')
             return None
 
         contacted = []
-        closest_node = closest[0]
+        closest_node = node_list.NodeList.sort_by_distance(shortlist, nodeid)[0]
 
         while True:
             found_nodes = []
@@ -100,18 +111,24 @@ class KadNode(object):
             for node in found_nodes:
                 if not node_list.NodeList.node_in_list(shortlist, node):
                     shortlist.append(node)
-            shortlist = node_list.NodeList.sort_by_distance(shortlist, nodeid)
-            new_closest = shortlist[0]
+            # Contacts making equivalent progress towards the target are
+            # ordered by RTT, so the shortlist head is not necessarily the
+            # closest node.
+            shortlist = self.node_list.sort_by_proximity(shortlist, nodeid)
+            new_closest = node_list.NodeList.sort_by_distance(shortlist, nodeid)[0]
 
             # The sequence of parallel searches is continued until either no
             # node in the sets returned is closer than the closest node already
             # seen or the initiating node has accumulated k probed and known
             # to be active contacts.
             if node_list.distance(closest_node[2], nodeid) <= node_list.distance(new_closest[2], nodeid):
-                return shortlist[:self.node_list.k]
+                break
 
             closest_node = new_closest
-        return shortlist[:self.node_list.k]
+
+        # RTT only decides the order of queries. The result is used for
+        # replica placement, which must not depend on the caller's RTT view.
+        return node_list.NodeList.sort_by_distance(shortlist, nodeid)[:self.node_list.k]
 
 
     def store_value(self, value):
@@ -156,6 +173,7 @@ class KadNode(object):
 
     def ping_ip(self, addr, port):
         pingmsg = protocol.RPCMessage.ping_request(sender=self.node_id)
+        start = time.monotonic()
         try:
             sock = self.send(addr, port, str(pingmsg))
         except socket.gaierror:
@@ -163,6 +181,7 @@ class KadNode(object):
             return None
 
         resp = self.wait_for_response(sock)
+        rtt = time.monotonic() - start
         if not resp:
             self.logger.warning('ping timeout')
             return None
@@ -174,11 +193,14 @@ class KadNode(object):
             return None
 
         self.logger.debug('PING response from node %s', respmsg.sender)
-        self.node_list.add_node(addr, PORT, respmsg.sender)
+        self.node_list.add_node(addr, PORT, respmsg.sender, rtt=rtt)
         return respmsg.sender
 
     def setup_logger(self):
         root = logging.getLogger('kademlia')
+        if root.handlers:
+            # Already set up by another node in this process
+            return root
         handler = logging.StreamHandler(sys.stdout)
         handler.setLevel(logging.DEBUG)
         formatter = logging.Formatter(hex(self.node_id) + ': %(levelname)s: %(message)s')
@@ -193,27 +215,36 @@ class KadNode(object):
         thread.start()
         self._recv_thread = thread
 
-    def _receive(self):
+    def open_socket(self):
         thishost = socket.getfqdn()
         self.listenip = self.listenip or socket.gethostbyname(thishost)
         sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        if self.reuse_port:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
         sock.settimeout(1)
         sock.bind((self.listenip, PORT))
         self.logger.info('Listening on %s:%s (%s)', thishost, PORT, self.listenip)
+        return sock
+
+    def _receive(self):
+        sock = self.open_socket()
+        self._sock = sock
 
         while not self._stop_recv:
             try:
                 (msg, addr) = sock.recvfrom(protocol.MAX_MSG_SIZE)
             except socket.timeout:
                 continue
-            msg = msg.decode()
-            self.logger.debug('message from %s: %s', addr, msg)
-
-            resp = self.handle_request(msg, addr[0])
-            if resp:
-                sock.sendto(str(resp).encode(), addr)
+            self._handle_message(sock, msg.decode(), addr)
         self.logger.info('Stopping receive thread')
 
+    def _handle_message(self, sock, msg, addr):
+        self.logger.debug('message from %s: %s', addr, msg)
+
+        resp = self.handle_request(msg, addr[0])
+        if resp:
+            sock.sendto(str(resp).encode(), addr)
+
     def _handle_ping_request(self, rpc, sender_ip):
         self.logger.debug('Ping from node %s @ %s', rpc.sender, sender_ip)
         self.node_list.add_node(sender_ip, PORT, rpc.sender)
@@ -252,9 +283,12 @@ class KadNode(object):
             return protocol.RPCMessage.find_value_response(self.node_id, rpcid=rpc.rpcid, result=return_nodes, found_val=False)
 
 
+    @profiled
     def handle_request(self, msg, sender_ip):
-        rpc = protocol.RPCMessage.parse(msg)
+        return self.dispatch_request(protocol.RPCMessage.parse(msg), sender_ip)
 
+    @profiled
+    def dispatch_request(self, rpc, sender_ip):
         if rpc.msgtype != 'req':
             self.logger.warning('Unexpected message type recieved')
             return None
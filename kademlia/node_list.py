@@ -2,6 +2,10 @@ import math
 import datetime
 import logging
 import itertools
+import threading
+
+# Weight of a new sample in the smoothed RTT estimate (as in TCP's SRTT)
+RTT_SMOOTHING = 0.125
 
 def distance(id1, id2):
     return id1 ^ id2
@@ -14,6 +18,11 @@ class NodeList(object):
         self.id_size = id_size
         self.bucket_list = []
         self.k = k
+        # Smoothed round-trip time in seconds, per node ID in the buckets
+        self.rtt = {}
+        # Nodes are added from the receive thread, the CLI and, in worker
+        # mode, the inbox thread
+        self.lock = threading.RLock()
         for _ in range(id_size):
             self.bucket_list.append([])
 
@@ -31,19 +40,66 @@ class NodeList(object):
         dist = distance(self.nodeid, otherid)
         return self.distance_to_bucket_index(dist)
 
-    def add_node(self, ip, port, nodeid):
-        bucket = self.bucket_list[self.get_bucket_index(nodeid)]
-
-        ts = datetime.datetime.now().timestamp()
-        if len(bucket) < self.k:
-            if not self.bucket_contains_node(bucket, nodeid):
-                self.logger.debug('Adding node %s @ %s:%s', nodeid, ip, port)
-                bucket.append(((ip, port, nodeid), ts))
-                self.logger.debug('Bucket: %s', bucket)
-        else:
-            # TODO: eviction logic, for now, just ignore
-            # the new node if the bucket if full
-            pass
+    def add_node(self, ip, port, nodeid, rtt=None):
+        with self.lock:
+            bucket = self.bucket_list[self.get_bucket_index(nodeid)]
+
+            if self.bucket_contains_node(bucket, nodeid):
+                if rtt is not None:
+                    self.update_rtt(nodeid, rtt)
+                return False
+
+            if len(bucket) >= self.k:
+                # The bucket is full. Only a node with a measured RTT, i.e. one
+                # that has answered us, can get in.
+                if rtt is None:
+                    return False
+                evict = self.eviction_candidate(bucket, rtt)
+                if evict is None:
+                    return False
+                self.logger.debug('Replacing node %s with node %s @ %s:%s',
+                                  evict[0][2], nodeid, ip, port)
+                self.remove_node(evict[0][2])
+
+            ts = datetime.datetime.now().timestamp()
+            self.logger.debug('Adding node %s @ %s:%s', nodeid, ip, port)
+            bucket.append(((ip, port, nodeid), ts))
+            self.logger.debug('Bucket: %s', bucket)
+
+            if rtt is not None:
+                self.update_rtt(nodeid, rtt)
+            return True
+
+    def remove_node(self, nodeid):
+        with self.lock:
+            bucket = self.bucket_list[self.get_bucket_index(nodeid)]
+            for entry in bucket:
+                if entry[0][2] == nodeid:
+                    bucket.remove(entry)
+                    self.rtt.pop(nodeid, None)
+                    return True
+            return False
+
+    def update_rtt(self, nodeid, rtt):
+        with self.lock:
+            if nodeid in self.rtt:
+                rtt = (1 - RTT_SMOOTHING) * self.rtt[nodeid] + RTT_SMOOTHING * rtt
+            self.rtt[nodeid] = rtt
+
+    def get_rtt(self, nodeid):
+        return self.rtt.get(nodeid)
+
+    def eviction_candidate(self, bucket, rtt):
+        # Unmeasured nodes were only heard of from other nodes and have never
+        # answered us, so the oldest of them goes first. Otherwise, the slowest
+        # measured node goes if the new node is faster.
+        for entry in bucket:
+            if entry[0][2] not in self.rtt:
+                return entry
+        slowest = max(bucket, key=lambda entry: self.rtt[entry[0][2]])
+        if self.rtt[slowest[0][2]] <= rtt:
+            return None
+        return slowest
 
     @staticmethod
     def bucket_contains_node(bucket, nodeid):
@@ -75,20 +131,18 @@ class NodeList(object):
 
             bucket = self.bucket_list[bucket_index]
             if bucket:
-                # TODO: find the closest node in this bucket,
-                # for now, just return them in the order found
-                for node in bucket:
-                    ret = node[0]
-                    yield ret
+                nodes = [node for (node, _ts) in bucket]
+                yield from self.sort_by_proximity(nodes, nodeid)
 
     def get_n_closest(self, nodeid, n):
-        return list(itertools.islice(self.close_nodes(nodeid), n))
+        with self.lock:
+            return list(itertools.islice(self.close_nodes(nodeid), n))
 
     def get_k_closest(self, nodeid):
         return self.get_n_closest(nodeid, self.k)
 
     def get_closest_node(self, nodeid):
-        nodes = list(itertools.islice(self.close_nodes(nodeid), 1))
+        nodes = self.get_n_closest(nodeid, 1)
         return nodes[0] if nodes else None
 
     def get_node_info(self, nodeid):
@@ -110,3 +164,15 @@ class NodeList(object):
     @staticmethod
     def sort_by_distance(nodelist, target_nodeid):
         return sorted(nodelist, key=lambda node: distance(node[2], target_nodeid))
+
+    def proximity_key(self, node, target_nodeid):
+        # Nodes at the same log2 distance from the target make equivalent
+        # progress in a lookup, so among those, prefer the lowest RTT.
+        # Unmeasured nodes go last, and exact distance breaks any ties.
+        # The target node itself, if known, always comes first.
+        dist = distance(node[2], target_nodeid)
+        rtt = self.rtt.get(node[2], math.inf)
+        return (self.distance_to_bucket_index(dist), dist != 0, rtt, dist)
+
+    def sort_by_proximity(self, nodelist, target_nodeid):
+        return sorted(nodelist, key=lambda node: self.proximity_key(node, target_nodeid))
@@ -2,6 +2,8 @@ import json
 import enum
 import random
 
+from kademlia.profiling import profiled
+
 MAX_MSG_SIZE = 2000
 
 class RPCCommand(enum.Enum):
@@ -77,6 +79,7 @@ class RPCMessage(object):
         return cls(cls.RESP, RPCCommand.FIND_VALUE, sender, rpcid=rpcid, data=data)
 
     @classmethod
+    @profiled
     def parse(cls, msgstr):
         msg = json.loads(msgstr)
 
@@ -93,6 +96,7 @@ class RPCMessage(object):
                    rpcid=msg['rpcid'],
                    data=(msg['data'] if 'data' in msg else None))
 
+    @profiled
     def __str__(self):
         msg = {'msgtype': self.msgtype,
                'command': self.command.value,
@@ -10,3 +10,17 @@ class NodeTest(unittest.TestCase):
     def test_generate_node_id(self):
         for bits in range(1, 10):
             self.assertLess(kadnode.generate_node_id(bits), 2**bits)
+
+    def test_node_lookup_returns_xor_order(self):
+        node = kadnode.KadNode(node_id=1024)
+        self.assertEqual(node.node_list.get_bucket_index(4), node.node_list.get_bucket_index(5))
+        node.send_find_node = lambda *args: {'nodes': []}
+
+        # Nodes 4 and 5 are in the same bucket and the same distance band
+        # from target 6, the farther one is faster and gets queried first
+        node.node_list.add_node('4.4.4.4', 1, 4, rtt=0.5)
+        node.node_list.add_node('5.5.5.5', 1, 5, rtt=0.1)
+        self.assertEqual([n[2] for n in node.node_list.get_k_closest(6)], [5, 4])
+
+        # but the result is ordered by XOR distance only
+        self.assertEqual([n[2] for n in node.node_lookup(6)], [4, 5])
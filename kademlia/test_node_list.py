@@ -107,3 +107,53 @@ class NodeListTest(unittest.TestCase):
             ('', 0, 85)
         ]
         self.assertEqual(self.nl.sort_by_distance(nodelist, 128), expected)
+
+    def test_rtt_smoothing(self):
+        self.nl.add_node('1.1.1.1', 42, 1, rtt=0.1)
+        self.assertEqual(self.nl.get_rtt(1), 0.1)
+        self.nl.add_node('1.1.1.1', 42, 1, rtt=0.9)
+        self.assertAlmostEqual(self.nl.get_rtt(1), 0.2)
+        self.assertIsNone(self.nl.get_rtt(2))
+
+    def test_prefer_low_rtt(self):
+        # Nodes 4 and 5 are in the same bucket and at the same log2 distance
+        # from target 6, the faster one should come first
+        self.nl.add_node('4.4.4.4', 1, 4, rtt=0.5)
+        self.nl.add_node('5.5.5.5', 1, 5, rtt=0.1)
+        self.assertEqual([n[2] for n in self.nl.get_k_closest(6)], [5, 4])
+
+        # An exact match always comes first
+        self.assertEqual(self.nl.get_closest_node(4)[2], 4)
+
+    def test_full_bucket_admission(self):
+        # Bucket 7 holds node IDs 128-255, k is 3
+        self.nl.add_node('1.1.1.1', 1, 128)
+        self.nl.add_node('2.2.2.2', 1, 129, rtt=0.5)
+        self.nl.add_node('3.3.3.3', 1, 130, rtt=0.2)
+
+        # Unmeasured nodes never get into a full bucket
+        self.nl.add_node('4.4.4.4', 1, 131)
+        self.assertIsNone(self.nl.get_node_info(131))
+
+        # A measured node replaces an unmeasured one first, even if slower
+        # than every measured node
+        self.nl.add_node('5.5.5.5', 1, 132, rtt=0.9)
+        self.assertIsNone(self.nl.get_node_info(128))
+        self.assertEqual(self.nl.get_rtt(132), 0.9)
+
+        # Then only if faster than the slowest measured node, which it replaces
+        self.nl.add_node('6.6.6.6', 1, 133, rtt=0.95)
+        self.assertIsNone(self.nl.get_node_info(133))
+        self.nl.add_node('7.7.7.7', 1, 134, rtt=0.1)
+        self.assertEqual(len(self.nl), 3)
+        self.assertIsNone(self.nl.get_node_info(132))
+        self.assertIsNone(self.nl.get_rtt(132))
+        self.assertIsNotNone(self.nl.get_node_info(129))
+        self.assertEqual(self.nl.get_rtt(134), 0.1)
+
+    def test_remove_node(self):
+        self.nl.add_node('1.1.1.1', 42, 1, rtt=0.1)
+        self.assertTrue(self.nl.remove_node(1))
+        self.assertEqual(len(self.nl), 0)
+        self.assertIsNone(self.nl.get_rtt(1))
+        self.assertFalse(self.nl.remove_node(1))
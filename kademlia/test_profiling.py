@@ -0,0 +1,54 @@
+import os
+import tempfile
+import unittest
+
+from kademlia import profiling
+from kademlia import protocol
+
+
+class ProfilingTest(unittest.TestCase):
+
+    def setUp(self):
+        profiling.profiler.reset()
+
+    def tearDown(self):
+        profiling.profiler.enabled = False
+        profiling.profiler.mode = profiling.TIMING
+        profiling.profiler.sample_rate = 1.0
+        profiling.profiler.reset()
+
+    def test_disabled_records_nothing(self):
+        protocol.RPCMessage.parse(str(protocol.RPCMessage.ping_request(123)))
+        self.assertEqual(profiling.profiler.spans, {})
+        self.assertIsNone(profiling.profiler.stats)
+
+    def test_timing_spans(self):
+        profiling.profiler.enable(mode=profiling.TIMING)
+        for _ in range(3):
+            protocol.RPCMessage.parse(str(protocol.RPCMessage.ping_request(123)))
+
+        (count, total, worst) = profiling.profiler.spans['RPCMessage.parse']
+        self.assertEqual(count, 3)
+        self.assertGreaterEqual(total, worst)
+        self.assertEqual(profiling.profiler.spans['RPCMessage.__str__'][0], 3)
+
+    def test_cprofile_sampling(self):
+        profiling.profiler.enable(mode=profiling.CPROFILE, sample_rate=1.0)
+        protocol.RPCMessage.parse(str(protocol.RPCMessage.ping_request(123)))
+        self.assertIn('parse', profiling.profiler.report())
+
+    def test_invalid_settings(self):
+        with self.assertRaises(ValueError):
+            profiling.profiler.enable(mode='perf')
+        with self.assertRaises(ValueError):
+            profiling.profiler.enable(sample_rate=0)
+        self.assertFalse(profiling.profiler.enabled)
+
+    def test_dump(self):
+        profiling.profiler.enable(mode=profiling.TIMING)
+        str(protocol.RPCMessage.ping_request(123))
+        with tempfile.TemporaryDirectory() as tmpdir:
+            output = os.path.join(tmpdir, 'profile.txt')
+            profiling.profiler.dump(output)
+            with open(output) as f:
+                self.assertIn('RPCMessage.__str__', f.read())
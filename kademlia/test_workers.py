@@ -0,0 +1,199 @@
+import multiprocessing
+import os
+import queue
+import socket
+import tempfile
+import time
+import unittest
+
+from kademlia import kadnode
+from kademlia import profiling
+from kademlia import protocol
+from kademlia import workers
+
+
+class FakeSocket(object):
+    def __init__(self):
+        self.sent = []
+
+    def sendto(self, data, addr):
+        self.sent.append((data.decode(), addr))
+
+
+def _fill_unread_inbox(inbox):
+    # Far more than a pipe buffer, with nobody reading
+    for _ in range(100):
+        inbox.put((workers.NODE, '1.1.1.1', 1, 2**159, 1000 * 'x'))
+    workers.abandon_inboxes([inbox])
+
+
+class WorkerTest(unittest.TestCase):
+    NUM_WORKERS = 3
+
+    def setUp(self):
+        self.inboxes = [queue.Queue() for _ in range(self.NUM_WORKERS)]
+        self.node = workers.WorkerNode(1, self.inboxes, listenip='127.0.0.1')
+        self.sock = FakeSocket()
+
+    def test_key_owner(self):
+        owners = [workers.key_owner(key, self.NUM_WORKERS) for key in range(6)]
+        self.assertEqual(owners, [0, 1, 2, 0, 1, 2])
+
+    def test_publish_new_nodes(self):
+        self.node.node_list.add_node('1.1.1.1', 42, 1, rtt=0.1)
+        # Adding the same node again is not published
+        self.node.node_list.add_node('1.1.1.1', 42, 1)
+
+        self.assertTrue(self.inboxes[1].empty())
+        for index in [0, 2]:
+            self.assertEqual(self.inboxes[index].get_nowait(), (workers.NODE, '1.1.1.1', 42, 1, 0.1))
+            self.assertTrue(self.inboxes[index].empty())
+
+    def test_publish_rtt_update(self):
+        self.node.node_list.add_node('1.1.1.1', 42, 1, rtt=0.1)
+        self.inboxes[0].get_nowait()
+        self.node.node_list.add_node('1.1.1.1', 42, 1, rtt=0.9)
+
+        rtt = self.node.node_list.get_rtt(1)
+        self.assertAlmostEqual(rtt, 0.2)
+        self.assertEqual(self.inboxes[0].get_nowait(), (workers.RTT, 1, rtt))
+
+    def test_publish_eviction(self):
+        nl = workers.SharedNodeList(0, 8, publish=self.inboxes[0].put, k=2)
+        nl.add_node('1.1.1.1', 1, 128, rtt=0.5)
+        nl.add_node('2.2.2.2', 1, 129, rtt=0.2)
+        nl.add_node('3.3.3.3', 1, 130, rtt=0.1)
+
+        changes = [self.inboxes[0].get_nowait() for _ in range(4)]
+        self.assertEqual(changes[2:], [(workers.REMOVE, 128), (workers.NODE, '3.3.3.3', 1, 130, 0.1)])
+        self.assertTrue(self.inboxes[0].empty())
+
+    def test_apply_changes(self):
+        nl = self.node.node_list
+        nl.apply_change((workers.NODE, '1.1.1.1', 42, 1, 0.3))
+        self.assertIsNotNone(nl.get_node_info(1))
+        self.assertEqual(nl.get_rtt(1), 0.3)
+
+        # The publisher's smoothed RTT replaces ours
+        nl.apply_change((workers.RTT, 1, 0.7))
+        self.assertEqual(nl.get_rtt(1), 0.7)
+
+        nl.apply_change((workers.REMOVE, 1))
+        self.assertIsNone(nl.get_node_info(1))
+        self.assertIsNone(nl.get_rtt(1))
+
+        # Changes from other workers are not published again
+        for inbox in self.inboxes:
+            self.assertTrue(inbox.empty())
+
+    def test_forward_unowned_key(self):
+        msg = str(protocol.RPCMessage.store_request(123, 5, 'value'))
+        self.node._handle_message(self.sock, msg, ('2.2.2.2', 5000))
+
+        self.assertEqual(self.sock.sent, [])
+        self.assertEqual(self.node.stored_data, {})
+        (msgtype, rpc, addr) = self.inboxes[2].get_nowait()
+        self.assertEqual(msgtype, workers.REQUEST)
+        self.assertEqual(str(rpc), msg)
+        self.assertEqual(addr, ('2.2.2.2', 5000))
+
+        # The owner handles the forwarded request without parsing it again
+        owner = workers.WorkerNode(2, self.inboxes, listenip='127.0.0.1')
+        owner._handle_rpc(self.sock, rpc, addr)
+        self.assertEqual(owner.stored_data, {5: 'value'})
+        self.assertEqual(self.sock.sent[0][1], ('2.2.2.2', 5000))
+
+    def test_handle_owned_key(self):
+        msg = str(protocol.RPCMessage.store_request(123, 4, 'value'))
+        self.node._handle_message(self.sock, msg, ('2.2.2.2', 5000))
+
+        self.assertEqual(self.node.stored_data, {4: 'value'})
+        (resp, addr) = self.sock.sent[0]
+        self.assertEqual(addr, ('2.2.2.2', 5000))
+        self.assertTrue(protocol.RPCMessage.parse(resp).data['result'])
+
+    def test_handle_other_requests_locally(self):
+        msg = str(protocol.RPCMessage.ping_request(123))
+        self.node._handle_message(self.sock, msg, ('2.2.2.2', 5000))
+        self.assertEqual(len(self.sock.sent), 1)
+
+    def test_non_int_key_handled_locally(self):
+        msg = str(protocol.RPCMessage.store_request(123, 'abc', 'value'))
+        self.node._handle_message(self.sock, msg, ('2.2.2.2', 5000))
+
+        self.assertEqual(self.node.stored_data, {'abc': 'value'})
+        self.assertEqual(len(self.sock.sent), 1)
+        for inbox in self.inboxes:
+            self.assertTrue(inbox.empty())
+
+    def test_invalid_message_dropped(self):
+        for msg in ['not json', '{}', '{"msgtype": "req", "command": 99, "sender": 1, "rpcid": 1}']:
+            self.node._handle_message(self.sock, msg, ('2.2.2.2', 5000))
+        self.assertEqual(self.sock.sent, [])
+
+    def test_profile_commands(self):
+        self.node.publish_profile(workers.PROFILE_ON, profiling.TIMING, 1.0)
+        self.assertEqual(self.inboxes[0].get_nowait(), (workers.PROFILE, workers.PROFILE_ON, profiling.TIMING, 1.0))
+        self.assertTrue(self.inboxes[1].empty())
+
+        try:
+            self.node.apply_profile((workers.PROFILE, workers.PROFILE_ON, profiling.TIMING, 1.0))
+            self.assertTrue(profiling.profiler.enabled)
+            with tempfile.TemporaryDirectory() as tmpdir:
+                output = os.path.join(tmpdir, 'profile.txt')
+                self.node.apply_profile((workers.PROFILE, workers.PROFILE_DUMP, output))
+                self.assertTrue(os.path.exists(output + '.worker1'))
+            self.node.apply_profile((workers.PROFILE, workers.PROFILE_OFF))
+            self.assertFalse(profiling.profiler.enabled)
+        finally:
+            profiling.profiler.enabled = False
+            profiling.profiler.reset()
+
+    def test_exit_with_unread_inbox(self):
+        inbox = multiprocessing.Queue()
+        process = multiprocessing.Process(target=_fill_unread_inbox, args=(inbox,))
+        process.start()
+        process.join(timeout=10)
+        hung = process.is_alive()
+        if hung:
+            process.kill()
+        self.assertFalse(hung)
+
+
+@unittest.skipUnless(workers.reuse_port_supported(), 'SO_REUSEPORT not supported')
+class WorkerGroupTest(unittest.TestCase):
+    NUM_WORKERS = 2
+
+    def setUp(self):
+        self.group = workers.WorkerGroup(self.NUM_WORKERS, '127.0.0.1')
+        self.node = self.group.start()
+        # Let the other worker bind the port
+        time.sleep(1)
+
+    def tearDown(self):
+        self.group.close()
+
+    def rpc(self, msg):
+        # A new socket, and so a new flow, for every request, so that the
+        # requests are spread over both workers
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        try:
+            sock.sendto(str(msg).encode(), ('127.0.0.1', kadnode.PORT))
+            resp = kadnode.KadNode.wait_for_response(sock)
+        finally:
+            sock.close()
+        self.assertIsNotNone(resp)
+        return protocol.RPCMessage.parse(resp)
+
+    def test_store_and_find_value(self):
+        # Keys owned by both workers: whichever worker gets a request, about
+        # half of them have to be forwarded to the other one.
+        for key in range(8):
+            resp = self.rpc(protocol.RPCMessage.store_request(123, key, f'value {key}'))
+            self.assertTrue(resp.data['result'])
+        for key in range(8):
+            resp = self.rpc(protocol.RPCMessage.find_value_request(123, key))
+            self.assertEqual(resp.data['value'], f'value {key}')
+
+        # Worker 0 only stores the keys it owns
+        self.assertEqual(sorted(self.node.stored_data), [0, 2, 4, 6])
@@ -0,0 +1,275 @@
+"""
+Multi-process server mode.
+
+A single KadNode is limited to one core by the GIL. In this mode, a node is
+served by several worker processes sharing the same node ID, each with its
+own socket bound to the same port with SO_REUSEPORT, so that the kernel
+spreads incoming datagrams over them.
+
+Workers talk to each other through one inbox queue per worker:
+ * Changes to a worker's routing table (new nodes, RTT updates and
+   removals) are published to all other workers, so that every worker
+   answers FIND_NODE alike.
+ * Stored data is partitioned by key over the workers. A STORE or FIND_VALUE
+   request received by a worker not owning the key is forwarded to the owner,
+   which answers the client directly from its own socket.
+ * The CLI's profile commands are passed on from worker 0 to the others.
+   Each worker writes its results to <output>.worker<index>.
+
+Worker 0 runs in the main process, next to the CLI.
+"""
+import multiprocessing
+import signal
+import socket
+import threading
+
+from kademlia import kadnode
+from kademlia import node_list
+from kademlia import protocol
+from kademlia.profiling import profiler
+
+# Inbox message types
+NODE = 'node'
+RTT = 'rtt'
+REMOVE = 'remove'
+REQUEST = 'request'
+PROFILE = 'profile'
+STOP = 'stop'
+ROUTING_CHANGES = [NODE, RTT, REMOVE]
+
+# PROFILE actions
+PROFILE_ON = 'on'
+PROFILE_OFF = 'off'
+PROFILE_DUMP = 'dump'
+
+DATA_COMMANDS = [protocol.RPCCommand.STORE, protocol.RPCCommand.FIND_VALUE]
+
+
+def reuse_port_supported():
+    return hasattr(socket, 'SO_REUSEPORT')
+
+
+def key_owner(key, num_workers):
+    return key % num_workers
+
+
+class SharedNodeList(node_list.NodeList):
+    """
+    A NodeList publishing its changes to the other workers.
+
+    New nodes, RTT changes and removals are published, so that evictions
+    from full buckets are decided on the same RTT data in every worker.
+    Changes received from other workers are applied with apply_change()
+    and are not published again.
+    """
+
+    def __init__(self, nodeid, id_size, publish, k=20):
+        super().__init__(nodeid, id_size, k=k)
+        self.publish = publish
+        # Only read and written with the lock held
+        self._applying = False
+
+    def add_node(self, ip, port, nodeid, rtt=None):
+        with self.lock:
+            old_rtt = self.rtt.get(nodeid)
+            added = super().add_node(ip, port, nodeid, rtt=rtt)
+            if not self._applying:
+                if added:
+                    self.publish((NODE, ip, port, nodeid, self.rtt.get(nodeid)))
+                elif self.rtt.get(nodeid) != old_rtt:
+                    self.publish((RTT, nodeid, self.rtt[nodeid]))
+            return added
+
+    def remove_node(self, nodeid):
+        with self.lock:
+            removed = super().remove_node(nodeid)
+            if removed and not self._applying:
+                self.publish((REMOVE, nodeid))
+            return removed
+
+    def apply_change(self, change):
+        with self.lock:
+            self._applying = True
+            try:
+                if change[0] == NODE:
+                    (_type, ip, port, nodeid, rtt) = change
+                    super().add_node(ip, port, nodeid, rtt=rtt)
+                    # Take the publisher's smoothed RTT as is
+                    if rtt is not None and nodeid in self.rtt:
+                        self.rtt[nodeid] = rtt
+                elif change[0] == RTT:
+                    (_type, nodeid, rtt) = change
+                    if self.get_node_info(nodeid):
+                        self.rtt[nodeid] = rtt
+                elif change[0] == REMOVE:
+                    (_type, nodeid) = change
+                    self.remove_node(nodeid)
+            finally:
+                self._applying = False
+
+
+class WorkerNode(kadnode.KadNode):
+    reuse_port = True
+
+    def __init__(self, index, inboxes, listenip=None, node_id=None):
+        super().__init__(listenip=listenip, node_id=node_id)
+        self.index = index
+        self.inboxes = inboxes
+        self.node_list = SharedNodeList(nodeid=self.node_id, id_size=self.id_size,
+                                        publish=self.publish_change)
+        self._inbox_thread = None
+
+    def __str__(self):
+        return f'Node {self.node_id} (worker {self.index})'
+
+    def publish_change(self, change):
+        for index, inbox in enumerate(self.inboxes):
+            if index != self.index:
+                inbox.put(change)
+
+    def publish_profile(self, action, *args):
+        self.publish_change((PROFILE, action) + args)
+
+    def apply_profile(self, item):
+        action = item[1]
+        if action == PROFILE_ON:
+            (_type, _action, mode, sample_rate) = item
+            profiler.enable(mode=mode, sample_rate=sample_rate)
+        elif action == PROFILE_OFF:
+            profiler.disable()
+        elif action == PROFILE_DUMP:
+            (_type, _action, output) = item
+            try:
+                profiler.dump(f'{output}.worker{self.index}' if output else None)
+            except OSError as e:
+                self.logger.error('Failed to write profile: %s', e)
+
+    def request_owner(self, rpc):
+        if rpc.msgtype != protocol.RPCMessage.REQ or rpc.command not in DATA_COMMANDS:
+            return self.index
+        # Keys that aren't node IDs are stored by whichever worker gets them
+        if not rpc.data or not isinstance(rpc.data.get('key'), int):
+            return self.index
+        return key_owner(rpc.data['key'], len(self.inboxes))
+
+    def _handle_message(self, sock, msg, addr):
+        self.logger.debug('message from %s: %s', addr, msg)
+
+        # An exception here would stop the receive thread, while the kernel
+        # keeps sending this worker's share of the traffic to its socket.
+        try:
+            # Parsed once here, forwarded requests are passed on parsed
+            rpc = protocol.RPCMessage.parse(msg)
+            owner = self.request_owner(rpc)
+            if owner != self.index:
+                self.logger.debug('Forwarding request from %s to worker %s', addr, owner)
+                self.inboxes[owner].put((REQUEST, rpc, addr))
+                return
+            self._handle_rpc(sock, rpc, addr)
+        except Exception as e:
+            self.logger.warning('Dropping message from %s: %r', addr, e)
+
+    def _handle_rpc(self, sock, rpc, addr):
+        resp = self.dispatch_request(rpc, addr[0])
+        if resp:
+            sock.sendto(str(resp).encode(), addr)
+
+    def start_receive(self):
+        super().start_receive()
+        thread = threading.Thread(target=self._read_inbox)
+        thread.daemon = True
+        thread.start()
+        self._inbox_thread = thread
+
+    def _read_inbox(self):
+        inbox = self.inboxes[self.index]
+        while True:
+            item = inbox.get()
+            if item[0] == STOP:
+                break
+            elif item[0] in ROUTING_CHANGES:
+                self.node_list.apply_change(item)
+            elif item[0] == PROFILE:
+                self.apply_profile(item)
+            elif item[0] == REQUEST:
+                (_type, rpc, addr) = item
+                if self._sock is None:
+                    self.logger.warning('Dropping forwarded request, socket not open yet')
+                    continue
+                try:
+                    self._handle_rpc(self._sock, rpc, addr)
+                except Exception as e:
+                    self.logger.warning('Dropping forwarded request from %s: %r', addr, e)
+        self.logger.info('Stopping inbox thread')
+
+    def wait_for_stop(self):
+        self._inbox_thread.join()
+
+    def close(self):
+        if self._inbox_thread.is_alive():
+            self.inboxes[self.index].put((STOP,))
+            self._inbox_thread.join()
+        super().close()
+
+
+def _run_worker(index, inboxes, listenip, node_id, profiling):
+    # Ctrl-C in the CLI reaches the whole process group, the main process
+    # stops the workers with a STOP message instead.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+    (enabled, mode, sample_rate, output) = profiling
+    profiler.mode = mode
+    profiler.sample_rate = sample_rate
+    profiler.output = f'{output}.worker{index}'
+    profiler.enabled = enabled
+
+    node = WorkerNode(index, inboxes, listenip=listenip, node_id=node_id)
+    node.start_receive()
+    node.wait_for_stop()
+    node.close()
+    abandon_inboxes(inboxes)
+    if profiler.enabled:
+        profiler.dump()
+
+
+def abandon_inboxes(inboxes):
+    # Once a worker has stopped, nothing reads its inbox any more. A process
+    # exits only after flushing what it put into the queues, which would
+    # hang for good on a full pipe. What is still queued at shutdown is
+    # dropped instead.
+    for inbox in inboxes:
+        inbox.cancel_join_thread()
+
+
+class WorkerGroup(object):
+    def __init__(self, num_workers, listenip=None, node_id=None):
+        if not reuse_port_supported():
+            raise RuntimeError('SO_REUSEPORT is not supported on this platform')
+
+        self.num_workers = num_workers
+        self.listenip = listenip
+        self.inboxes = [multiprocessing.Queue() for _ in range(num_workers)]
+        self.node = WorkerNode(0, self.inboxes, listenip=listenip, node_id=node_id)
+        self.processes = []
+
+    def start(self):
+        profiling = (profiler.enabled, profiler.mode, profiler.sample_rate, profiler.output)
+        for index in range(1, self.num_workers):
+            process = multiprocessing.Process(
+                target=_run_worker,
+                args=(index, self.inboxes, self.listenip, self.node.node_id, profiling))
+            process.daemon = True
+            process.start()
+            self.processes.append(process)
+        self.node.start_receive()
+        return self.node
+
+    def close(self):
+        # Sent from this process, STOP is queued behind any profile command
+        # sent to the workers before
+        for inbox in self.inboxes[1:]:
+            inbox.put((STOP,))
+        self.node.close()
+        for process in self.processes:
+            process.join()
+        abandon_inboxes(self.inboxes)